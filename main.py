@@ -6,11 +6,27 @@ from ui import UI
 MAX_OPEN_SECONDS = 300 # maximum open time per day in actual seconds
 SLOW_UPDATE_MS = 500 # time between slower updates in milliseconds
 UPDATE_MS = 10 # time between updates in milliseconds
+TRACE_PATH = None # file to record a sensor trace to for replaying with rm_trace.py, None to disable
+PROFILE_PATH = None # file to dump a Chrome trace JSON of state transitions to on exit, None to disable
+PROFILE_SIZE = 4096 # number of state transition events kept while profiling
 
 # Main
+window = None
 try:
     app = QApplication([])
-    window = UI(UPDATE_MS, SLOW_UPDATE_MS, MAX_OPEN_SECONDS)
+    window = UI(UPDATE_MS, SLOW_UPDATE_MS, MAX_OPEN_SECONDS, TRACE_PATH, PROFILE_SIZE if PROFILE_PATH else 0)
     app.exec_()
 finally:
-    rpi_cleanup()
+    # Make the valve safe first, then close the trace and dump the profile even if the app crashed,
+    # since that is when they are needed most
+    try:
+        rpi_cleanup()
+    finally:
+        if window is not None:
+            window.eventLoop.close_trace()
+            if PROFILE_PATH:
+                # A bad PROFILE_PATH shouldn't hide the error that stopped the app
+                try:
+                    window.eventLoop.dump_profile(PROFILE_PATH)
+                except OSError as e:
+                    print('Could not dump the profile: ' + str(e))
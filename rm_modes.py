@@ -13,6 +13,12 @@ import time
 import math
 import keyboard
 
+def demo_key_pressed():
+    """
+    Returns whether the 'p' key is held, which opens the valve in sensor mode as if water was detected.
+    """
+    return keyboard.is_pressed('p')
+
 # Still need to clean up, decrease dependencies on parent object (EventLoop) within a few modes
 # Potential improvement for future seems: work solely based off of signals, UI updates triggered
 # by signals emitted within each Mode, pass information using these pyqtSignals
@@ -59,29 +65,34 @@ class SensorMode(AbstractMode):
     Uses the water sensor for opening/closing the valve.
     """
 
-    def __init__(self, parent, updateMs, label):
+    def __init__(self, parent, updateMs, label, sensor=water_detected, override=demo_key_pressed):
         """
         Initializer for the object. Includes a GUI element.
         `label` is the label that should be updated when the sensor state changes.
+        `sensor` is the method to read the water sensor with, replaced when replaying a trace.
+        `override` is the method checked when no water is detected to open the valve anyway, also replaced when replaying.
         """
         super(SensorMode, self).__init__(parent, updateMs)
         self.label = label
+        self.sensor = sensor
+        self.override = override
         self.previousState = None
 
     def update(self):
         """
         Turns on/off the valve depending on if water is detected
         """
-        waterDetected = water_detected()
+        # Record the combined reading, so a replay sees the override the same as water
+        waterDetected = self.sensor() or self.override()
+        if self.parent.recorder is not None:
+            self.parent.recorder.sensor(waterDetected)
 
-        if waterDetected or keyboard.is_pressed('p'): # Water Detected
-            startValve = WaterDetected(self, self.updateMs, self.maxOpenSeconds, self.label)
-            startValve.activate()
+        if waterDetected: # Water Detected
             if self.previousState is None or not self.previousState:
                 self.parent.open_valve()
                 self.label.setText("Currently Running")
             self.previousState = True
-        elif not waterDetected: # No Water Detected
+        else: # No Water Detected
             if self.previousState is None or self.previousState:
                 self.parent.close_valve()
                 self.label.setText("No Water Detected")
@@ -105,7 +116,7 @@ class TimedMode(AbstractMode):
         self.maxOpenSeconds = maxOpenSeconds
         self.progressBar = progressBar
         self.signal = signal
-        self.timerWatch = Stopwatch()
+        self.timerWatch = Stopwatch(clock=parent.clock)
 
     def activate(self):
         """
@@ -149,7 +160,7 @@ class TimeOpenMode(AbstractMode):
         """
         super(TimeOpenMode, self).__init__(parent, updateMs)
         self.maxOpenSeconds = maxOpenSeconds
-        self.timerWatch = Stopwatch()
+        self.timerWatch = Stopwatch(clock=parent.clock)
         self.timerShouldReset = False
         self.label = label
         self.signal = signal
@@ -160,7 +171,7 @@ class TimeOpenMode(AbstractMode):
         """
 
         # The time should reset at midnight
-        if time.strftime("%H:%M:%S") == "00:00:00":
+        if time.strftime("%H:%M:%S", time.localtime(self.parent.clock())) == "00:00:00":
             self.timerShouldReset = True
 
         # If timerWatch is running, the valve should be on, so continuously update the label and check if time exceeded
@@ -197,6 +208,25 @@ class ClockMode(AbstractMode):
         timeDate = time.asctime()
         self.label.setText(timeDate)
 
+class TraceSyncMode(AbstractMode):
+    """
+    Object representing the trace being synced to disk, so buffered sensor samples are never held for long.
+    """
+
+    def __init__(self, parent, updateMs, recorder):
+        """
+        Initializer for the object.
+        `recorder` is the TraceRecorder to sync.
+        """
+        super(TraceSyncMode, self).__init__(parent, updateMs)
+        self.recorder = recorder
+
+    def update(self):
+        """
+        Syncs the trace.
+        """
+        self.recorder.sync()
+
 # Inherits QObject to allow for pyqtSignal usage
 class EventLoop(QObject):
     """
@@ -209,18 +239,27 @@ class EventLoop(QObject):
     timerFinished = pyqtSignal() # emitted when timed mode finishes
     timeLimitReached = pyqtSignal() # emitted when time limit for the day reached
 
-    def __init__(self, ui, updateMs=10, slowUpdateMs=500, maxOpenSeconds=300):
+    def __init__(self, ui, updateMs=10, slowUpdateMs=500, maxOpenSeconds=300, recorder=None, tracer=None,
+                 valve=output_valve, sensor=water_detected, override=demo_key_pressed, clock=time.time):
         """
         Initializer for the object. Basically everything happens here.
         `updateMs` is the interval between loops.
         `slowUpdateMs` is the interval between slower loops.
         `maxOpenSeconds` is the maximum amount of time the valve should be opened for each day.
+        `recorder` is the TraceRecorder to record sensor samples, valve writes and transitions to, or None.
+        `tracer` is the TransitionTracer to profile state transitions with, or None.
+        `valve`, `sensor`, `override` and `clock` are the device and time methods used, replaced when replaying a trace
+        so that the EventLoop can run without the Pi or a GUI.
         """
         super(EventLoop, self).__init__()
         self.ui = ui
         self.updateMs = updateMs
         self.slowUpdateMs = slowUpdateMs
         self.maxOpenSeconds = maxOpenSeconds
+        self.recorder = recorder
+        self.tracer = tracer
+        self.outputValve = valve
+        self.clock = clock
 
         # Keeps track of the valve opening/closing
         self.valveRecord = TimeStampLog()
@@ -235,21 +274,72 @@ class EventLoop(QObject):
         self.clockMode.activate()
 
         # Loop for sensor mode
-        self.sensorMode = SensorMode(self, self.updateMs, ui.waterStatusLabel)
+        self.sensorMode = SensorMode(self, self.updateMs, ui.waterStatusLabel, sensor, override)
 
         # Loop for timed mode
         self.timedMode = TimedMode(self, self.updateMs, self.maxOpenSeconds, ui.timerProgress, self.timerFinished)
 
+        # Loop for syncing the trace to disk, if one is being recorded
+        if self.recorder is not None:
+            self.traceSyncMode = TraceSyncMode(self, self.slowUpdateMs, self.recorder)
+            self.traceSyncMode.activate()
+
+        # Record transitions, and the signals of this object that cause them, into the trace before any of their
+        # logic runs, if one is being recorded
+        if self.recorder is not None:
+            self.timerFinished.connect(lambda: self.recorder.signal('timerFinished'))
+            self.timeLimitReached.connect(lambda: self.recorder.signal('timeLimitReached'))
+            ui.idle.entered.connect(lambda: self.recorder.state('idle'))
+            ui.manualEnabled.entered.connect(lambda: self.recorder.state('manualEnabled'))
+            ui.sensorEnabled.entered.connect(lambda: self.recorder.state('sensorEnabled'))
+            ui.timerEnabled.entered.connect(lambda: self.recorder.state('timerEnabled'))
+
+        # Profile triggers and state changes before any of their logic runs, if transitions are being traced
+        if self.tracer is not None:
+            self.trace_trigger(ui.stopButton.clicked, 'stopButton')
+            self.trace_trigger(ui.demoSwitch.clicked, 'demoSwitch')
+            self.trace_trigger(ui.scheduleModeSelect.clicked, 'scheduleModeSelect')
+            self.trace_trigger(ui.detectRainModeSelect.clicked, 'detectRainModeSelect')
+            self.trace_trigger(self.timerFinished, 'timerFinished')
+            self.trace_trigger(self.timeLimitReached, 'timeLimitReached')
+            for name in ('idle', 'manualEnabled', 'sensorEnabled', 'timerEnabled'):
+                state = getattr(ui, name)
+                state.entered.connect(lambda name=name: self.tracer.state(name, 'entered'))
+                state.exited.connect(lambda name=name: self.tracer.state(name, 'exited'))
+
         # State machine-related transition logic
-        ui.manualEnabled.entered.connect(self.open_valve)
-        ui.manualEnabled.exited.connect(self.close_valve)
-        ui.sensorEnabled.entered.connect(self.sensorMode.activate)
-        ui.sensorEnabled.exited.connect(self.sensorMode.deactivate)
-        ui.timerEnabled.entered.connect(self.timedMode.activate)
-        ui.timerEnabled.exited.connect(self.timedMode.deactivate)
+        self.connect_state(ui.manualEnabled.entered, self.open_valve)
+        self.connect_state(ui.manualEnabled.exited, self.close_valve)
+        self.connect_state(ui.sensorEnabled.entered, self.sensorMode.activate)
+        self.connect_state(ui.sensorEnabled.exited, self.sensorMode.deactivate)
+        self.connect_state(ui.timerEnabled.entered, self.timedMode.activate)
+        self.connect_state(ui.timerEnabled.exited, self.timedMode.deactivate)
 
         # VERY IMPORTANT, upon entering idle it should always close the valve
-        ui.idle.entered.connect(self.close_valve)
+        self.connect_state(ui.idle.entered, self.close_valve)
+
+        # Close the trigger's latency window once the entered state's logic has run, if transitions are being traced
+        if self.tracer is not None:
+            for name in ('idle', 'manualEnabled', 'sensorEnabled', 'timerEnabled'):
+                getattr(ui, name).entered.connect(self.tracer.transition_done)
+
+    def trace_trigger(self, signal, name):
+        """
+        Records each emit of `signal` into the tracer as the trigger called `name`.
+        Transitions run as the signal is emitted, so the trigger expires once control returns to the event loop.
+        """
+        def trigger(*args):
+            self.tracer.trigger(name)
+            QTimer.singleShot(0, self.tracer.expire_trigger)
+        signal.connect(trigger)
+
+    def connect_state(self, signal, handler):
+        """
+        Connects `handler` to a state's entered/exited `signal`, timing it if transitions are being traced.
+        """
+        if self.tracer is not None:
+            handler = self.tracer.wrap(handler.__qualname__, handler)
+        signal.connect(handler)
 
     def open_valve(self):
         """
@@ -258,11 +348,11 @@ class EventLoop(QObject):
         # Logistical stuff only executes if valve is closed
         if not self.valveWatch.running:
             self.valveWatch.start()
-            self.valveRecord.open_time(time.time())
+            self.valveRecord.open_time(self.clock())
             #self.ui.lastOpenLabel.setText('Last open: ' + self.valveRecord.get_last_open())
             self.update_log()
         #lightning()
-        output_valve(1)
+        self.write_valve(1)
     
     def close_valve(self):
         """
@@ -272,12 +362,37 @@ class EventLoop(QObject):
         # Logistical stuff only executes if valve is open
         if self.valveWatch.running:
             self.valveWatch.stop()
-            self.valveRecord.close_time(time.time())
+            self.valveRecord.close_time(self.clock())
             #this line cause the program to crash
             #self.ui.lastOpenLabel.setText('Last open: ' + self.valveRecord.get_last_open() + " for " + self.valveRecord.get_time_open() + " seconds")
             self.update_log()
         #turnOffLED()
-        output_valve(0)
+        self.write_valve(0)
+
+    def write_valve(self, signal):
+        """
+        Sends `signal` to the valve, recording it into the trace if one is being recorded.
+        The valve is always written first, so neither tracing nor recording can delay or prevent it.
+        """
+        self.outputValve(signal)
+        if self.tracer is not None:
+            self.tracer.gpio(signal)
+        if self.recorder is not None:
+            self.recorder.valve(signal)
+
+    def close_trace(self):
+        """
+        Flushes and closes the trace, if one is being recorded.
+        """
+        if self.recorder is not None:
+            self.recorder.close()
+
+    def dump_profile(self, path):
+        """
+        Writes the traced state transitions to `path` as Chrome trace JSON, if transitions are being traced.
+        """
+        if self.tracer is not None:
+            self.tracer.dump(path)
 
     def update_log(self):
         """
@@ -0,0 +1,122 @@
+"""rm_profile.py
+Contains the opt-in tracer for state machine transitions and their latency.
+"""
+
+from collections import deque
+import json
+import time
+
+# Event kinds kept in the ring buffer
+TRIGGER = 'trigger' # a signal that causes a transition, i.e. a button click or timeLimitReached
+STATE = 'state' # a state being entered or exited
+HANDLER = 'handler' # a method connected to a state's entered/exited signal
+GPIO = 'gpio' # a signal written to the valve
+
+class TransitionTracer(object):
+    """
+    Records triggers, state changes, handler durations and trigger-to-GPIO latency into a fixed-size ring buffer,
+    so that it can be left running without growing. Times come from time.perf_counter, in seconds.
+    """
+
+    def __init__(self, size=4096):
+        """
+        Initializer for the object.
+        `size` is the number of events to keep, older events are dropped first.
+        """
+        self.events = deque(maxlen=size)
+        self.pendingTrigger = None
+        self.inTransition = False
+
+    def trigger(self, name):
+        """
+        Records that the trigger called `name` fired. If it causes a transition, the first valve write during
+        that transition measures its latency from here.
+        A trigger that is re-emitted while pending, i.e. timeLimitReached every loop, keeps the time it first fired.
+        A different trigger replaces it, since the pending one then caused no transition.
+        """
+        now = time.perf_counter()
+        if self.pendingTrigger is None or self.pendingTrigger[0] != name:
+            self.pendingTrigger = (name, now)
+        self.events.append((TRIGGER, name, now))
+
+    def expire_trigger(self):
+        """
+        Drops the pending trigger unless a transition is in progress, called once control returns to the event loop,
+        so that a trigger that caused no transition (i.e. stopButton while idle) is never measured from later.
+        """
+        if not self.inTransition:
+            self.pendingTrigger = None
+
+    def transition_done(self):
+        """
+        Closes the latency window of the transition, called once the entered state's logic has run,
+        so that a later valve write that the trigger did not cause is never measured from it.
+        """
+        self.pendingTrigger = None
+        self.inTransition = False
+
+    def state(self, name, change):
+        """
+        Records that the state called `name` was entered or exited, given by `change`.
+        A state being exited or entered means a transition is in progress, which opens the latency window.
+        """
+        self.inTransition = True
+        self.events.append((STATE, name + '.' + change, time.perf_counter()))
+
+    def wrap(self, name, handler):
+        """
+        Returns `handler` wrapped so that each call records its duration under `name`.
+        """
+        def timed(*args):
+            start = time.perf_counter()
+            handler()
+            self.events.append((HANDLER, name, start, time.perf_counter() - start))
+        return timed
+
+    def gpio(self, signal):
+        """
+        Records a valve write of `signal`, along with the latency from the pending trigger if it is made during
+        the transition that trigger caused. Only the first write after a trigger measures its latency.
+        """
+        now = time.perf_counter()
+        if self.inTransition and self.pendingTrigger is not None:
+            triggerName, triggerTime = self.pendingTrigger
+            self.pendingTrigger = None
+            self.events.append((GPIO, signal, now, triggerName, now - triggerTime))
+        else:
+            self.events.append((GPIO, signal, now, None, None))
+
+    def latencies(self):
+        """
+        Returns a list of (trigger name, seconds) for every trigger-to-GPIO latency still in the buffer.
+        """
+        return [(event[3], event[4]) for event in self.events if event[0] == GPIO and event[3] is not None]
+
+    def timeline(self):
+        """
+        Returns the buffered events as a list of Chrome trace events (viewable in chrome://tracing or Perfetto).
+        Triggers, states and valve writes are instant events, handlers and trigger-to-GPIO latencies are spans.
+        """
+        timeline = []
+        for event in self.events:
+            kind = event[0]
+            if kind == HANDLER:
+                timeline.append({'name': event[1], 'cat': kind, 'ph': 'X', 'ts': event[2] * 1e6,
+                                 'dur': event[3] * 1e6, 'pid': 0, 'tid': 0})
+            elif kind == GPIO:
+                timeline.append({'name': 'valve ' + str(event[1]), 'cat': kind, 'ph': 'i', 's': 'p',
+                                 'ts': event[2] * 1e6, 'pid': 0, 'tid': 0})
+                if event[3] is not None:
+                    timeline.append({'name': event[3] + ' -> valve ' + str(event[1]), 'cat': 'latency', 'ph': 'X',
+                                     'ts': (event[2] - event[4]) * 1e6, 'dur': event[4] * 1e6, 'pid': 0, 'tid': 1})
+            else:
+                timeline.append({'name': event[1], 'cat': kind, 'ph': 'i', 's': 'p',
+                                 'ts': event[2] * 1e6, 'pid': 0, 'tid': 0})
+        return timeline
+
+    def dump(self, path):
+        """
+        Writes the timeline to `path` as Chrome trace JSON.
+        """
+        with open(path, 'w') as traceFile:
+            json.dump({'traceEvents': self.timeline(), 'displayTimeUnit': 'ms'}, traceFile)
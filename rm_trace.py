@@ -0,0 +1,379 @@
+"""rm_trace.py
+Contains the sensor trace recorder and the replay driver used to reproduce field issues.
+"""
+
+import os
+import struct
+import time
+
+from PyQt5.QtCore import QCoreApplication
+
+from rm_modes import EventLoop
+
+# Trace file layout: a header (magic + version) followed by fixed-size records of (timestamp, kind, value)
+TRACE_MAGIC = b'RMTR'
+TRACE_VERSION = 2
+HEADER = struct.Struct('<4sH')
+RECORD = struct.Struct('<dBB')
+
+# Record kinds
+SENSOR = 0 # value is the sensor reading SensorMode acted on, including the 'p' key override
+VALVE = 1 # value is the signal written to the valve
+STATE = 2 # value is the index of the entered state in STATE_NAMES
+SIGNAL = 3 # value is the index of the emitted EventLoop signal in SIGNAL_NAMES
+
+# Top-level states of the UI state machine, in the order they are encoded
+STATE_NAMES = ('idle', 'manualEnabled', 'sensorEnabled', 'timerEnabled')
+
+# EventLoop signals that cause transitions, in the order they are encoded, along with the states they leave for idle
+# (mirrors the transitions added in ui.py)
+SIGNAL_NAMES = ('timerFinished', 'timeLimitReached')
+SIGNAL_TRANSITIONS = {
+    'timerFinished': ('timerEnabled',),
+    'timeLimitReached': ('manualEnabled', 'sensorEnabled', 'timerEnabled'),
+}
+
+TOLERANCE_SECONDS = 0.5 # how far apart a recorded and a replayed valve action can be and still match
+
+
+class TraceRecorder(object):
+    """
+    Records sensor samples, valve writes and state transitions into a compact binary trace.
+    Sensor samples are only written when the reading changes, since SensorMode only acts on changes,
+    which keeps a day of 10ms polling down to a handful of records.
+    Valve writes and transitions are written out immediately, sensor samples stay buffered until the next sync(),
+    which EventLoop calls every slow loop and which is also when everything written gets synced to disk.
+    Recording never raises: if writing the trace fails (i.e. the disk is full), recording stops and `failed` is set,
+    since the trace must never get in the way of driving the valve.
+    """
+
+    def __init__(self, path):
+        """
+        Initializer for the object, opens the trace file and writes the header.
+        `path` is the file the trace should be written to.
+        """
+        self.file = open(path, 'wb')
+        self.file.write(HEADER.pack(TRACE_MAGIC, TRACE_VERSION))
+        self.file.flush()
+        self.buffer = bytearray()
+        self.lastSensor = None
+        self.lastSignal = None
+        self.unsynced = False
+        self.failed = False
+
+    def record(self, kind, value):
+        """
+        Appends one record, stamped with the current time.
+        `kind` is one of SENSOR, VALVE, STATE or SIGNAL.
+        `value` is the (small, non-negative) integer value of the record.
+        """
+        if self.failed:
+            return
+        self.buffer += RECORD.pack(time.time(), kind, value)
+        if kind != SENSOR:
+            self.flush()
+
+    def sensor(self, value):
+        """
+        Records a sensor sample, skipping it if the reading has not changed.
+        """
+        value = int(bool(value))
+        if value != self.lastSensor:
+            self.lastSensor = value
+            self.record(SENSOR, value)
+
+    def valve(self, signal):
+        """
+        Records a signal written to the valve.
+        """
+        self.record(VALVE, int(signal))
+
+    def state(self, name):
+        """
+        Records that the state machine entered the state called `name`.
+        """
+        self.lastSignal = None
+        self.record(STATE, STATE_NAMES.index(name))
+
+    def signal(self, name):
+        """
+        Records that the EventLoop signal called `name` was emitted, skipping repeats until the next transition,
+        since the modes keep emitting it every loop until the state machine acts on it.
+        """
+        if name != self.lastSignal:
+            self.lastSignal = name
+            self.record(SIGNAL, SIGNAL_NAMES.index(name))
+
+    def flush(self, sync=False):
+        """
+        Writes out any buffered records, so they survive the app crashing or being killed.
+        `sync` also syncs them to disk so they survive the Pi losing power, which is too slow to do for every record.
+        """
+        if self.failed:
+            return
+        try:
+            if self.buffer:
+                self.file.write(self.buffer)
+                self.file.flush()
+                self.unsynced = True
+            # Only sync when something was written since the last one, to spare the SD card
+            if sync and self.unsynced:
+                os.fsync(self.file.fileno())
+                self.unsynced = False
+        except (OSError, ValueError): # ValueError if the file was already closed
+            self.failed = True
+        del self.buffer[:]
+
+    def sync(self):
+        """
+        Writes out the buffered sensor samples and syncs everything written so far to disk.
+        """
+        self.flush(sync=True)
+
+    def close(self):
+        """
+        Flushes, syncs and closes the trace file.
+        """
+        if not self.file.closed:
+            self.flush(sync=True)
+            self.failed = True # nothing more can be recorded
+            try:
+                self.file.close()
+            except OSError:
+                pass
+
+def read_trace(path):
+    """
+    Reads a trace file, returning a list of (timestamp, kind, value) tuples.
+    """
+    with open(path, 'rb') as traceFile:
+        data = traceFile.read()
+
+    magic, version = HEADER.unpack_from(data)
+    if magic != TRACE_MAGIC or version != TRACE_VERSION:
+        raise ValueError('Not a version ' + str(TRACE_VERSION) + ' trace file!')
+
+    body = memoryview(data)[HEADER.size:]
+    body = body[:len(body) - len(body) % RECORD.size] # drop a partially written last record
+    return list(RECORD.iter_unpack(body))
+
+class NullWidget(object):
+    """
+    Stands in for the GUI labels and progress bar that the modes update, since replaying has no GUI.
+    """
+
+    def setText(self, text):
+        pass
+
+    def setValue(self, value):
+        pass
+
+class ReplaySignal(object):
+    """
+    Stands in for a QState's entered/exited signal, calling connected handlers in the order they were connected.
+    """
+
+    def __init__(self):
+        self.handlers = []
+
+    def connect(self, handler):
+        self.handlers.append(handler)
+
+    def emit(self):
+        for handler in self.handlers:
+            handler()
+
+class ReplayState(object):
+    """
+    Stands in for one of the UI's QStates, only providing the signals EventLoop connects to.
+    """
+
+    def __init__(self):
+        self.entered = ReplaySignal()
+        self.exited = ReplaySignal()
+
+class ReplayUI(object):
+    """
+    Stands in for the UI object, with just the widgets and states that EventLoop uses.
+    """
+
+    def __init__(self):
+        self.notificationLabel = NullWidget()
+        self.clockLabel = NullWidget()
+        self.waterStatusLabel = NullWidget()
+        self.timerProgress = NullWidget()
+        for name in STATE_NAMES:
+            setattr(self, name, ReplayState())
+
+class ReplayDriver(object):
+    """
+    Feeds a recorded trace back through a real EventLoop as fast as possible, collecting the resulting valve actions.
+    The EventLoop runs headless: the valve, sensor and clock are replaced with the trace, and user-caused transitions
+    are replayed from the recording by emitting the stand-in states' signals. Transitions caused by the EventLoop's
+    own timerFinished/timeLimitReached are not replayed from the recording; the replayed EventLoop has to emit them
+    itself, so a change in the time limit or timed mode logic shows up in the diff.
+    Instead of by their timers, the active modes are updated at each record, and at the times in between when they
+    can next act: the time limit or timed mode running out, and midnight.
+    """
+
+    def __init__(self, records, maxOpenSeconds=300):
+        """
+        Initializer for the object.
+        `records` is the list of records returned by read_trace.
+        `maxOpenSeconds` should match the value the trace was recorded with.
+        """
+        # The modes' QTimers need an application to start, although replaying never runs its event loop
+        self.app = QCoreApplication.instance() or QCoreApplication([])
+        self.records = records
+        self.now = records[0][0] if records else 0
+        self.updatedAt = None
+        self.sensorValue = 0
+        self.stateName = None
+        self.skipTimerTransition = False
+        self.actions = []
+        self.ui = ReplayUI()
+        self.eventLoop = EventLoop(self.ui, maxOpenSeconds=maxOpenSeconds, valve=self.write_valve,
+                                   sensor=self.read_sensor, override=lambda: False, clock=self.read_clock)
+        self.eventLoop.timerFinished.connect(lambda: self.timer_transition('timerFinished'))
+        self.eventLoop.timeLimitReached.connect(lambda: self.timer_transition('timeLimitReached'))
+
+    def read_sensor(self):
+        """
+        Returns the sensor reading at the current point of the trace.
+        """
+        return self.sensorValue
+
+    def read_clock(self):
+        """
+        Returns the time at the current point of the trace.
+        """
+        return self.now
+
+    def write_valve(self, signal):
+        """
+        Collects a valve write made by the EventLoop.
+        """
+        self.actions.append((self.now, signal))
+
+    def enter_state(self, name):
+        """
+        Exits the current state and enters the state called `name`, as the state machine would.
+        """
+        if self.stateName is not None:
+            getattr(self.ui, self.stateName).exited.emit()
+        self.stateName = name
+        getattr(self.ui, name).entered.emit()
+
+    def timer_transition(self, name):
+        """
+        Goes to idle if the replayed EventLoop emitted the signal called `name` in a state it transitions from.
+        """
+        if self.stateName in SIGNAL_TRANSITIONS[name]:
+            self.enter_state('idle')
+
+    def next_update(self):
+        """
+        Returns the next time before the coming record at which an active mode can act on its own, or None.
+        """
+        times = []
+        timeOpenMode = self.eventLoop.timeOpenMode
+        if timeOpenMode.timer.isActive():
+            if self.eventLoop.valveWatch.running:
+                times.append(self.now + timeOpenMode.maxOpenSeconds - self.eventLoop.valveWatch.value())
+            elif timeOpenMode.timerShouldReset:
+                times.append(self.now + self.eventLoop.updateMs / 1000)
+            day = time.localtime(self.now)
+            times.append(time.mktime((day.tm_year, day.tm_mon, day.tm_mday + 1, 0, 0, 0, 0, 0, -1)))
+        timedMode = self.eventLoop.timedMode
+        if timedMode.timer.isActive():
+            times.append(self.now + timedMode.maxOpenSeconds - timedMode.timerWatch.value())
+        return min(times) if times else None
+
+    def advance(self, timestamp):
+        """
+        Updates the active modes at every time up to `timestamp` at which they can act on their own.
+        """
+        while True:
+            nextTime = self.next_update()
+            if nextTime is None or nextTime > timestamp:
+                break
+            if self.updatedAt is not None and nextTime <= self.updatedAt:
+                break # already updated since it was due and nothing happened, so nothing will
+            # Land just after the limit, since float error could leave the watch a hair short of it
+            nextTime = max(nextTime, self.now) + 1e-6
+            self.now = nextTime
+            self.updatedAt = nextTime
+            self.update_modes(False)
+
+    def update_modes(self, sensorChanged):
+        """
+        Updates the active modes, as their timers would have. SensorMode is only updated for recorded samples,
+        since every update that changed the reading it acted on was recorded.
+        """
+        for mode in (self.eventLoop.timeOpenMode, self.eventLoop.timedMode):
+            if mode.timer.isActive():
+                mode.update()
+        if sensorChanged and self.eventLoop.sensorMode.timer.isActive():
+            self.eventLoop.sensorMode.update()
+
+    def run(self):
+        """
+        Replays every record, returning the list of (timestamp, signal) valve actions produced.
+        """
+        for timestamp, kind, value in self.records:
+            self.advance(timestamp)
+            self.now = max(timestamp, self.now)
+            if kind == SIGNAL:
+                # The recorded EventLoop caused the next transition to idle, the replayed one has to cause its own
+                self.skipTimerTransition = True
+            elif kind == STATE:
+                name = STATE_NAMES[value]
+                if not (self.skipTimerTransition and name == 'idle'):
+                    self.enter_state(name)
+                self.skipTimerTransition = False
+                self.update_modes(False)
+            elif kind == SENSOR:
+                self.sensorValue = value
+                self.update_modes(True)
+        return self.actions
+
+    def recorded_actions(self):
+        """
+        Returns the list of (timestamp, signal) valve writes that were recorded in the trace.
+        """
+        return [(timestamp, value) for timestamp, kind, value in self.records if kind == VALVE]
+
+    def diff(self, tolerance=TOLERANCE_SECONDS):
+        """
+        Replays the trace and compares the valve actions against the recorded ones.
+        Actions mismatch if their signals differ or they are more than `tolerance` seconds apart.
+        Returns a list of (index, recorded, replayed) for every mismatch, where either side may be None
+        if one sequence is longer than the other. An empty list means the replay matched the recording.
+        """
+        recorded = self.recorded_actions()
+        replayed = self.run()
+        mismatches = []
+        for i in range(max(len(recorded), len(replayed))):
+            expected = recorded[i] if i < len(recorded) else None
+            actual = replayed[i] if i < len(replayed) else None
+            if (expected is None or actual is None or expected[1] != actual[1]
+                    or abs(expected[0] - actual[0]) > tolerance):
+                mismatches.append((i, expected, actual))
+        return mismatches
+
+def replay_trace(path, maxOpenSeconds=300, tolerance=TOLERANCE_SECONDS):
+    """
+    Replays the trace at `path`, returning the mismatches found by ReplayDriver.diff.
+    """
+    return ReplayDriver(read_trace(path), maxOpenSeconds).diff(tolerance)
+
+if __name__ == '__main__':
+    import sys
+
+    start = time.time()
+    # Usage: python rm_trace.py <trace> [maxOpenSeconds]
+    maxOpenSeconds = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+    mismatches = replay_trace(sys.argv[1], maxOpenSeconds)
+    for index, expected, actual in mismatches:
+        print('Action ' + str(index) + ': recorded ' + str(expected) + ', replayed ' + str(actual))
+    print(str(len(mismatches)) + ' mismatch(es), replayed in ' + str(round(time.time() - start, 2)) + ' seconds')
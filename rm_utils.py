@@ -9,11 +9,13 @@ class Stopwatch(object):
     Allows easier tracking of time, instead of having a bunch of random variables.
     """
 
-    def __init__(self, startTime=time.time()):
+    def __init__(self, startTime=time.time(), clock=time.time):
         """
         Initializer for the object.
         `startTime` is the time at which the Stopwatch started. Should usually be the time at which it was instantiated.
+        `clock` is the method returning the current time, replaced when replaying a trace.
         """
+        self.clock = clock
         self.startTime = startTime
         self.running = False
         self.totalTime = 0
@@ -23,7 +25,7 @@ class Stopwatch(object):
         Starts the stopwatch.
         """
         if not self.running:
-            self.startTime = time.time()
+            self.startTime = self.clock()
             self.running = True
 
     def stop(self):
@@ -31,7 +33,7 @@ class Stopwatch(object):
         Stops the stopwatch, adding on elapsed time to the totalTime.
         """
         if self.running:
-            self.totalTime += time.time() - self.startTime
+            self.totalTime += self.clock() - self.startTime
             self.running = False
 
     def reset(self):
@@ -39,14 +41,14 @@ class Stopwatch(object):
         Resets the time of the stopwatch to 0.
         """
         self.totalTime = 0
-        self.startTime = time.time()
+        self.startTime = self.clock()
 
     def value(self):
         """
         Returns the total time for which the stopwatch has been running.
         """
         if self.running:
-            return self.totalTime + time.time() - self.startTime
+            return self.totalTime + self.clock() - self.startTime
         else:
             return self.totalTime
 
@@ -11,7 +11,71 @@ class Lizard(object):
 
 # List wrapper class for lizards, allows function chaining
 # i.e. lizards.of_gender(...).of_species(...).of_name(...)
+# a tank's lizards route changes through the tank, so its cached expectedWater stays up to date
 class Lizards(list):
+    tank = None # Tank these lizards belong to, if any
+
+    def append(self, lizard):
+        if self.tank is not None:
+            self.tank.add_lizard(lizard)
+        else:
+            super(Lizards, self).append(lizard)
+
+    def extend(self, lizards):
+        for i in lizards:
+            self.append(i)
+
+    def __iadd__(self, lizards):
+        self.extend(lizards)
+        return self
+
+    def remove(self, lizard):
+        if self.tank is not None:
+            self.tank.remove_lizard(lizard)
+        else:
+            super(Lizards, self).remove(lizard)
+
+    def pop(self, index=-1):
+        if self.tank is None:
+            return super(Lizards, self).pop(index)
+        lizard = self[index]
+        self.tank.remove_lizard(lizard)
+        return lizard
+
+    def clear(self):
+        if self.tank is not None:
+            self.tank.remove_lizard(Lizards(self))
+        else:
+            super(Lizards, self).clear()
+
+    def __delitem__(self, index):
+        if self.tank is None:
+            super(Lizards, self).__delitem__(index)
+        elif isinstance(index, slice):
+            self.tank.remove_lizard(Lizards(self[index]))
+        else:
+            self.tank.remove_lizard(self[index])
+
+    # changes that can't be expressed as adding/removing lizards aren't allowed on a tank's lizards
+    def insert(self, index, lizard):
+        if self.tank is not None:
+            raise TypeError('Use add_lizard to add lizards to a tank!')
+        super(Lizards, self).insert(index, lizard)
+
+    def __setitem__(self, index, lizard):
+        if self.tank is not None:
+            raise TypeError('Use add_lizard/remove_lizard to change the lizards of a tank!')
+        super(Lizards, self).__setitem__(index, lizard)
+
+    def __imul__(self, count):
+        if self.tank is not None:
+            raise TypeError('Use add_lizard to add lizards to a tank!')
+        return super(Lizards, self).__imul__(count)
+
+    # copies and pickles don't belong to the tank
+    def __reduce_ex__(self, protocol):
+        return (Lizards, (list(self),))
+
     # gets lizards with matching name
     def of_name(self, name):
         filter = lambda x: x.name == name
@@ -31,7 +95,33 @@ class Lizards(list):
     def of_filter(self, filter):
         return Lizards([i for i in self if filter(i)])
 
+# Table of water needed per lizard each day, in the same volume unit as FLOW_RATE
+# keys can be a species, or a (species, gender) tuple for species whose genders need different amounts
+# unknown species raise KeyError unless a default is given, so a misspelled species can't silently need no water
+class WaterRequirements(dict):
+    def __init__(self, requirements=None, default=None):
+        super(WaterRequirements, self).__init__(requirements or {})
+        self.default = default
+
+    # get water needed by a single lizard, preferring a gender-specific entry over the species entry
+    def requirement(self, lizard):
+        if (lizard.species, lizard.gender) in self:
+            return self[(lizard.species, lizard.gender)]
+        if lizard.species in self:
+            return self[lizard.species]
+        if self.default is None:
+            raise KeyError('No water requirement for species ' + repr(lizard.species) + '!')
+        return self.default
+
+    # get water needed by all of the given lizards
+    def total(self, lizards):
+        return sum(self.requirement(i) for i in lizards)
+
 # Contains information for a single lizard tank
+# with requirements, expectedWater is derived from the lizards and kept up to date as they are added/removed,
+# otherwise it stays the hand-set constant; setting it keeps the owning Tanks total in step
+# each lizard's requirement is stored when it is added and subtracted again when it is removed, so after changing
+# the requirements table, call recompute_expected_water (or Tanks.update_requirements) to pick up the new values
 class Tank(object):
     # FLOW_RATE should be in volume per second
     FLOW_RATE = 0
@@ -40,11 +130,67 @@ class Tank(object):
     def set_flow_rate(val):
         Tank.FLOW_RATE = val
 
-    def __init__(self, tankVolume=1, expectedWater=1, lizards=Lizards()):
+    def __init__(self, tankVolume=1, expectedWater=1, lizards=None, requirements=None):
+        self.owner = None # Tanks object this tank belongs to, if any
         self.tankVolume = tankVolume
-        self.expectedWater = expectedWater
+        self._expectedWater = expectedWater
         self.currentWater = 0
-        self.lizards = lizards
+        self.lizards = lizards if isinstance(lizards, Lizards) else Lizards(lizards or [])
+        if self.lizards.tank is not None:
+            raise ValueError('Lizards already belong to another tank!')
+        self.lizards.tank = self
+        self.requirements = requirements
+        self.contributions = {} # water each lizard adds to expectedWater, when derived from requirements
+        if requirements is not None:
+            self.recompute_expected_water()
+
+    @property
+    def expectedWater(self):
+        return self._expectedWater
+
+    @expectedWater.setter
+    def expectedWater(self, expectedWater):
+        self.set_expected_water(expectedWater)
+
+    # set expectedWater, keeping the owning Tanks total in step
+    def set_expected_water(self, expectedWater):
+        if self.owner is not None:
+            self.owner.totalExpectedWater += expectedWater - self._expectedWater
+        self._expectedWater = expectedWater
+
+    # copies and unpickled tanks don't belong to any Tanks, and get lizards of their own
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['owner'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.lizards.tank is not None:
+            self.lizards = Lizards(list(self.lizards))
+        self.lizards.tank = self
+        self.contributions = dict(self.contributions)
+
+    # get each lizard's requirement under the given table, without changing the tank
+    def contributions_for(self, requirements):
+        return {i: requirements.requirement(i) for i in self.lizards}
+
+    # set the per-lizard requirements and the expectedWater they add up to
+    def apply_contributions(self, contributions):
+        self.contributions = contributions
+        self.set_expected_water(sum(contributions.values()))
+
+    # recompute expectedWater from every lizard in the tank
+    def recompute_expected_water(self):
+        self.apply_contributions(self.contributions_for(self.requirements))
+
+    # switch the tank to a new requirements table, looking every lizard up first so an unknown species
+    # leaves the tank unchanged; `contributions` can be passed in if they were already looked up
+    def set_requirements(self, requirements, contributions=None):
+        if contributions is None:
+            contributions = self.contributions_for(requirements)
+        self.requirements = requirements
+        self.apply_contributions(contributions)
 
     # get number of lizards
     def num_lizards(self):
@@ -53,7 +199,12 @@ class Tank(object):
     # can pass in single Lizard object or Lizards object
     def add_lizard(self, lizard):
         if isinstance(lizard, Lizard) and lizard not in self.lizards:
-            self.lizards.append(lizard)
+            # look up the requirement first, so an unknown species leaves the tank unchanged
+            requirement = self.requirements.requirement(lizard) if self.requirements is not None else 0
+            list.append(self.lizards, lizard)
+            if self.requirements is not None:
+                self.contributions[lizard] = requirement
+                self.set_expected_water(self.expectedWater + requirement)
         elif isinstance(lizard, Lizards):
             for i in lizard:
                 self.add_lizard(i)
@@ -63,7 +214,12 @@ class Tank(object):
     # can pass in single Lizard object or Lizards object
     def remove_lizard(self, lizard):
         if isinstance(lizard, Lizard) and lizard in self.lizards:
-            self.lizards.remove(lizard)
+            # subtract what the lizard added, which needs no lookup, so a species since dropped from the table can't fail
+            requirement = self.contributions.pop(lizard, 0)
+            list.remove(self.lizards, lizard)
+            if self.requirements is not None:
+                # start from exactly 0 once empty so float error can't build up
+                self.set_expected_water(self.expectedWater - requirement if self.lizards else 0)
         elif isinstance(lizard, Lizards):
             for i in lizard:
                 self.remove_lizard(i)
@@ -78,6 +234,101 @@ class Tank(object):
     def drain(self):
         self.currentWater = 0
 
-    # get fraction of tank expected water that has been given
+    # get fraction of tank expected water that has been given, a tank that needs no water is always full
     def get_fraction(self):
-        return self.currentWater / self.expectedWater
+        return self.currentWater / self.expectedWater if self.expectedWater else 1
+
+# List wrapper class for tanks, keeps the total expected water of all tanks cached
+# so schedule decisions and the daily budget don't need to walk every tank
+# a tank can only belong to one Tanks, and every list change goes through add_tank/remove_tank to keep the total in step
+class Tanks(list):
+    def __init__(self, tanks=(), requirements=None):
+        super(Tanks, self).__init__()
+        self.requirements = requirements
+        self.totalExpectedWater = 0
+        for i in tanks:
+            self.add_tank(i)
+
+    # tanks that derive their water from a table take on the shared table, if there is one
+    # tanks without a table keep their hand-set expectedWater
+    def add_tank(self, tank):
+        self.insert(len(self), tank)
+
+    def insert(self, index, tank):
+        if not isinstance(tank, Tank) or tank.owner is not None:
+            raise ValueError('Value is not a tank or already belongs to tanks!')
+        if self.requirements is not None and tank.requirements is not None:
+            tank.set_requirements(self.requirements)
+        super(Tanks, self).insert(index, tank)
+        tank.owner = self
+        self.totalExpectedWater += tank.expectedWater
+
+    def remove_tank(self, tank):
+        if not isinstance(tank, Tank) or tank.owner is not self:
+            raise ValueError('Value does not exist in tanks!')
+        super(Tanks, self).remove(tank)
+        tank.owner = None
+        self.totalExpectedWater -= tank.expectedWater
+
+    # list methods, routed through add_tank/remove_tank
+    def append(self, tank):
+        self.add_tank(tank)
+
+    def extend(self, tanks):
+        for i in tanks:
+            self.add_tank(i)
+
+    def __iadd__(self, tanks):
+        self.extend(tanks)
+        return self
+
+    def remove(self, tank):
+        self.remove_tank(tank)
+
+    def pop(self, index=-1):
+        tank = self[index]
+        self.remove_tank(tank)
+        return tank
+
+    def clear(self):
+        for tank in list(self):
+            self.remove_tank(tank)
+
+    def __delitem__(self, index):
+        for tank in (self[index] if isinstance(index, slice) else [self[index]]):
+            self.remove_tank(tank)
+
+    def __setitem__(self, index, tank):
+        raise TypeError('Use add_tank/remove_tank to change tanks!')
+
+    def __imul__(self, count):
+        raise TypeError('A tank can only belong to tanks once!')
+
+    # copies go through add_tank, so only deep copies (with copied tanks) are possible
+    def __reduce_ex__(self, protocol):
+        return (Tanks, (list(self), self.requirements))
+
+    # call after changing a requirements table (or to replace the shared one), recomputes every tank in one pass
+    # tanks without a table keep their hand-set expectedWater
+    # every lizard is looked up before anything is changed, so an unknown species leaves all tanks unchanged
+    def update_requirements(self, requirements=None):
+        shared = requirements if requirements is not None else self.requirements
+        updates = []
+        for tank in self:
+            if tank.requirements is not None:
+                table = shared if shared is not None else tank.requirements
+                updates.append((tank, table, tank.contributions_for(table)))
+
+        self.requirements = shared
+        for tank, table, contributions in updates:
+            tank.set_requirements(table, contributions)
+        # add up from scratch so float error from incremental updates can't build up
+        self.totalExpectedWater = sum(tank.expectedWater for tank in self)
+
+    # get total water all tanks need each day
+    def total_expected_water(self):
+        return self.totalExpectedWater
+
+    # get the daily budget in seconds the valve needs to be open to give every tank its water
+    def budget_seconds(self):
+        return self.totalExpectedWater / Tank.FLOW_RATE if Tank.FLOW_RATE else 0
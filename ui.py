@@ -6,6 +6,8 @@ from PyQt5.QtWidgets import QMainWindow, QPushButton, QLabel, QProgressBar, QRad
 from PyQt5.QtCore import QStateMachine, QState
 from PyQt5 import uic
 from rm_modes import EventLoop
+from rm_trace import TraceRecorder
+from rm_profile import TransitionTracer
 
 class UI(QMainWindow):
     """
@@ -13,12 +15,14 @@ class UI(QMainWindow):
     Also contains the state machine used for the GUI logic.
     """
     
-    def __init__(self, updateMs, slowUpdateMs, maxOpenSeconds):
+    def __init__(self, updateMs, slowUpdateMs, maxOpenSeconds, tracePath=None, profileSize=0):
         """
         Initializer for the GUI. Loads the ui file and creates the state machine.
         `updateMs` is the interval between loops.
         `slowUpdateMs` is the interval between slower loops, i.e. updating the clock label.
         `maxOpenSeconds` is the maximum amount of time the valve should be opened for each day.
+        `tracePath` is the file to record a sensor trace to, or None to not record one.
+        `profileSize` is the number of state transition events to keep for profiling, or 0 to not profile them.
         """
         super(UI, self).__init__()
         uic.loadUi("newUI.ui", self)
@@ -102,7 +106,9 @@ class UI(QMainWindow):
         self.machine.setErrorState(self.idle)
 
         # Create the EventLoop down here since there are some overlapping dependencies between these two objects
-        self.eventLoop = EventLoop(self, updateMs, slowUpdateMs, maxOpenSeconds)
+        recorder = TraceRecorder(tracePath) if tracePath else None
+        tracer = TransitionTracer(profileSize) if profileSize else None
+        self.eventLoop = EventLoop(self, updateMs, slowUpdateMs, maxOpenSeconds, recorder, tracer)
 
         # Further transitions based on EventLoop pyqtSignals
         self.manualEnabled.addTransition(self.eventLoop.timeLimitReached, self.idle)